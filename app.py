@@ -1,8 +1,22 @@
 import streamlit as st
 import pandas as pd
 import json
+import orjson
 import requests
+import xlsxwriter
+from requests.adapters import HTTPAdapter
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# shared HTTP session so repeated fetches reuse TCP/TLS connections
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
+# get the ATT&CK id (e.g. TA0001, T1059) from a STIX object's external references
+def mitre_id(refs):
+    return next((ref.get("external_id", "") for ref in refs if ref.get("source_name") == "mitre-attack"), "")
+
 
 # function to load ATT&CK data
 def load_attack(domain_name, stix_data, matrix_data, kill_chain_key):
@@ -14,74 +28,82 @@ def load_attack(domain_name, stix_data, matrix_data, kill_chain_key):
             tactic_order = obj.get("tactic_refs", [])
             break
 
-    tactics_by_id = {}
-    tactics_by_shortname = {}
+    kill_chains = frozenset(kill_chain_key)
 
+    # bucket objects by type in a single pass
+    tactics = []
+    patterns = []
     for obj in stix_data.get("objects", []):
-        if obj.get("type") == "x-mitre-tactic":
-            stix_id = obj.get("id")
-            short = obj.get("x_mitre_shortname")
-            name = obj.get("name", "")
-
-            code = ""
-            for ref in obj.get("external_references", []):
-                if ref.get("source_name") == "mitre-attack":
-                    code = ref.get("external_id", "")
-                    break
-
-            tactics_by_id[stix_id] = {
-                "shortname": short,
-                "tactic_name": name,
-                "tactic_id": code,
-            }
-            tactics_by_shortname[short] = {
-                "tactic_name": name,
-                "tactic_id": code,
-            }
-
-    rows = []
+        obj_type = obj.get("type")
+        if obj_type == "x-mitre-tactic":
+            tactics.append(obj)
+        elif obj_type == "attack-pattern":
+            if obj.get("revoked") or obj.get("x_mitre_deprecated"):
+                continue
+            domains = obj.get("x_mitre_domains")
+            if not domains or domain_name not in domains:
+                continue
+            patterns.append(obj)
 
-    for obj in stix_data.get("objects", []):
-        if obj.get("type") != "attack-pattern":
-            continue
-        if obj.get("revoked") or obj.get("x_mitre_deprecated"):
-            continue
-        if domain_name not in obj.get("x_mitre_domains", []):
-            continue
+    tactics_by_id = {}
+    tactics_by_shortname = {}
 
-        tech_code = ""
-        for ref in obj.get("external_references", []):
-            if ref.get("source_name") == "mitre-attack":
-                tech_code = ref.get("external_id", "")
-                break
+    for obj in tactics:
+        stix_id = obj.get("id")
+        short = obj.get("x_mitre_shortname")
+        name = obj.get("name", "")
+
+        code = mitre_id(obj.get("external_references", []))
+
+        tactics_by_id[stix_id] = {
+            "shortname": short,
+            "tactic_name": name,
+            "tactic_id": code,
+        }
+        tactics_by_shortname[short] = {
+            "tactic_name": name,
+            "tactic_id": code,
+        }
+
+    # collect rows column-wise so pandas can skip the row-to-column transpose
+    tactic_names = []
+    tactic_ids = []
+    technique_names = []
+    technique_ids = []
+    seen = set()
+
+    for obj in patterns:
+        tech_code = mitre_id(obj.get("external_references", []))
         if not tech_code or "." in tech_code:
             continue
 
         tech_name = obj.get("name", "")
 
-        for phase in obj.get("kill_chain_phases", []):
-            if phase.get("kill_chain_name") in kill_chain_key:
-                short = phase.get("phase_name")
-                t = tactics_by_shortname.get(short)
-                if t:
-                    rows.append({
-                        "tactic_name": t["tactic_name"],
-                        "tactic_id": t["tactic_id"],
-                        "technique_name": tech_name,
-                        "technique_id": tech_code
-                    })
-
-        for short in obj.get("x_mitre_tactics", []):
-            t = tactics_by_shortname.get(short)
-            if t:
-                rows.append({
-                    "tactic_name": t["tactic_name"],
-                    "tactic_id": t["tactic_id"],
-                    "technique_name": tech_name,
-                    "technique_id": tech_code
-                })
+        # tactics from kill chain phases, then from x_mitre_tactics
+        shorts = [phase.get("phase_name") for phase in obj.get("kill_chain_phases", [])
+                  if phase.get("kill_chain_name") in kill_chains]
+        shorts.extend(obj.get("x_mitre_tactics", []))
 
-    df = pd.DataFrame(rows).drop_duplicates().reset_index(drop=True)
+        for short in shorts:
+            t = tactics_by_shortname.get(short)
+            if not t:
+                continue
+            # both sources often name the same tactic, so dedupe here
+            key = (t["tactic_name"], t["tactic_id"], tech_name, tech_code)
+            if key in seen:
+                continue
+            seen.add(key)
+            tactic_names.append(t["tactic_name"])
+            tactic_ids.append(t["tactic_id"])
+            technique_names.append(tech_name)
+            technique_ids.append(tech_code)
+
+    df = pd.DataFrame({
+        "tactic_name": tactic_names,
+        "tactic_id": tactic_ids,
+        "technique_name": technique_names,
+        "technique_id": technique_ids
+    })
 
     # sort order
     tactic_sort_order = {}
@@ -90,8 +112,7 @@ def load_attack(domain_name, stix_data, matrix_data, kill_chain_key):
             tactic_sort_order[tactics_by_id[tac_id]["tactic_name"]] = i
 
     df["tactic_sort"] = df["tactic_name"].map(tactic_sort_order)
-    df = df.sort_values(by=["tactic_sort", "technique_name"]).drop(columns=["tactic_sort"])
-    df = df.reset_index(drop=True)
+    df = df.sort_values(by=["tactic_sort", "technique_name"], ignore_index=True).drop(columns=["tactic_sort"])
     return df
 
 
@@ -125,19 +146,70 @@ ENT_MATRIX_BASE = "https://raw.githubusercontent.com/mitre/cti/master/enterprise
 ICS_MATRIX_BASE = "https://raw.githubusercontent.com/mitre/cti/master/ics-attack/x-mitre-matrix/"
 
 
-def fetch_json_or_error(url, label):
-    """Attempt to retrieve JSON; if fails, display a friendly error."""
+# keep cached downloads and frames for a day; filenames are versioned so content rarely changes
+CACHE_TTL = 24 * 60 * 60
+
+
+class FileNotFound(Exception):
+    pass
+
+
+class InvalidJSON(Exception):
+    pass
+
+
+# downloads are kept as raw bytes: immutable, so cache_resource can share them without pickling
+@st.cache_resource(show_spinner=False, ttl=CACHE_TTL, max_entries=8)
+def download_file(url):
+    """Download a file; cached per URL. Failures raise and are not cached."""
+    resp = session.get(url)
+    if resp.status_code != 200:
+        raise FileNotFound(url)
+    return resp.content
+
+
+def fetch_or_error(future, url, label):
+    """Collect a download result; if it failed, display a friendly error."""
     try:
-        resp = requests.get(url)
-        if resp.status_code != 200:
-            st.error(f"{label} file not found at URL:\n{url}")
-            return None
-        return resp.json()
+        return future.result()
+    except FileNotFound:
+        st.error(f"{label} file not found at URL:\n{url}")
+        return None
     except Exception:
         st.error(f"Failed to fetch {label}. Check filename or network.")
         return None
 
 
+def parse_json(data, url):
+    """Parse downloaded JSON; raise InvalidJSON with the URL if it is not JSON."""
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        raise InvalidJSON(url)
+
+
+# cached wrapper keyed by URL so repeat runs skip the STIX scan
+# (the underscore-prefixed downloads are excluded from the cache key)
+@st.cache_data(show_spinner=False, ttl=CACHE_TTL, max_entries=4)
+def build_attack_df(domain_name, stix_url, matrix_url, kill_chain_key, _stix_bytes, _matrix_bytes):
+    return load_attack(domain_name, parse_json(_stix_bytes, stix_url), parse_json(_matrix_bytes, matrix_url), kill_chain_key)
+
+
+# write the sheet row by row in xlsxwriter's constant_memory mode
+# (pandas' to_excel emits cells column by column, which constant_memory cannot handle)
+def write_excel(df, columns, sheet_name):
+    output = BytesIO()
+    with xlsxwriter.Workbook(output, {"constant_memory": True}) as workbook:
+        worksheet = workbook.add_worksheet(sheet_name)
+        header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+
+        worksheet.write_row(0, 0, columns, header_format)
+        for row_num, row in enumerate(zip(*(df[col] for col in columns)), start=1):
+            worksheet.write_row(row_num, 0, row)
+
+    return output
+
+
 # validate input and process
 if st.button("Process ATT&CK Data"):
 
@@ -152,71 +224,108 @@ if st.button("Process ATT&CK Data"):
     ics_stix_url = ICS_STIX_BASE + ics_stix_file
     ics_matrix_url = ICS_MATRIX_BASE + ics_matrix_file
 
-    # validate & fetch JSON safely
-    ent_stix_data = fetch_json_or_error(ent_stix_url, "Enterprise STIX")
-    ent_matrix_data = fetch_json_or_error(ent_matrix_url, "Enterprise Matrix")
-    ics_stix_data = fetch_json_or_error(ics_stix_url, "ICS STIX")
-    ics_matrix_data = fetch_json_or_error(ics_matrix_url, "ICS Matrix")
+    # validate & fetch JSON safely, all four downloads in parallel
+    # (errors are reported from the main thread, where st.error works)
+    fetch_jobs = [
+        (ent_stix_url, "Enterprise STIX"),
+        (ent_matrix_url, "Enterprise Matrix"),
+        (ics_stix_url, "ICS STIX"),
+        (ics_matrix_url, "ICS Matrix"),
+    ]
+    # workers need the script run context, otherwise st.cache_resource
+    # treats every lookup from them as a miss and downloads again each click
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=4, initializer=add_script_run_ctx, initargs=(None, ctx)) as executor:
+        futures = [executor.submit(download_file, url) for url, _ in fetch_jobs]
+    # report failures in input order
+    fetched = [fetch_or_error(future, url, label) for future, (url, label) in zip(futures, fetch_jobs)]
 
     # stop if any file failed validation
-    if None in [ent_stix_data, ent_matrix_data, ics_stix_data, ics_matrix_data]:
+    if None in fetched:
         st.stop()
+    ent_stix_bytes, ent_matrix_bytes, ics_stix_bytes, ics_matrix_bytes = fetched
 
-    # get data
-    enterprise_df = load_attack(
-        "enterprise-attack",
-        ent_stix_data,
-        ent_matrix_data,
-        ("mitre-attack", "mitre-enterprise-attack")
-    )
-    enterprise_df["ENT/ICS"] = "ENT"
+    # get data (a file that downloaded but is not JSON is reported like a failed fetch)
+    try:
+        enterprise_df = build_attack_df(
+            "enterprise-attack",
+            ent_stix_url,
+            ent_matrix_url,
+            ("mitre-attack", "mitre-enterprise-attack"),
+            ent_stix_bytes,
+            ent_matrix_bytes
+        )
+        enterprise_df["ENT/ICS"] = "ENT"
+
+        ics_df = build_attack_df(
+            "ics-attack",
+            ics_stix_url,
+            ics_matrix_url,
+            ("mitre-attack", "mitre-ics-attack"),
+            ics_stix_bytes,
+            ics_matrix_bytes
+        )
+        ics_df["ENT/ICS"] = "ICS"
+    except InvalidJSON as e:
+        label = dict(fetch_jobs)[e.args[0]]
+        st.error(f"Failed to fetch {label}. Check filename or network.")
+        st.stop()
 
-    ics_df = load_attack(
-        "ics-attack",
-        ics_stix_data,
-        ics_matrix_data,
-        ("mitre-attack", "mitre-ics-attack")
-    )
-    ics_df["ENT/ICS"] = "ICS"
+    # give both frames the same categories so concat stacks category codes
+    for col in ("tactic_name", "tactic_id", "ENT/ICS"):
+        dtype = pd.CategoricalDtype(pd.Index(enterprise_df[col].unique()).union(ics_df[col].unique()))
+        enterprise_df[col] = enterprise_df[col].astype(dtype)
+        ics_df[col] = ics_df[col].astype(dtype)
 
     combined_df = pd.concat([enterprise_df, ics_df], ignore_index=True)
 
     # modify and reorder the data to format it properly
-    combined_df['TT_Key'] = combined_df['ENT/ICS'] + combined_df['tactic_name'] + combined_df['technique_name']
-    combined_df['Tactics With Code'] = combined_df['tactic_name'] + " (" + combined_df['tactic_id'] + ")"
-    combined_df['Techniques With Code'] = combined_df['technique_name'] + " (" + combined_df['technique_id'] + ")"
-
-    unique_tactics = combined_df[['Tactics With Code']].drop_duplicates().reset_index(drop=True)
-    unique_tactics['Tactics_Order'] = range(1, len(unique_tactics) + 1)
-    combined_df = combined_df.merge(unique_tactics, on='Tactics With Code', how='left')
-
-    combined_df['Techniques_Order'] = combined_df.groupby('Tactics With Code').cumcount() + 1
+    # (list comprehensions skip pandas' object-dtype + dispatch; the categorical
+    # columns yield a Categorical from .values, which iterates as plain strings)
+    ent_ics = combined_df['ENT/ICS'].values
+    tactic_names = combined_df['tactic_name'].values
+    tactic_ids = combined_df['tactic_id'].values
+    technique_names = combined_df['technique_name'].values
+    technique_ids = combined_df['technique_id'].values
+    combined_df['TT_Key'] = [e + tn + tech for e, tn, tech in zip(ent_ics, tactic_names, technique_names)]
+    combined_df['Tactics With Code'] = [f"{tn} ({tc})" for tn, tc in zip(tactic_names, tactic_ids)]
+    combined_df['Techniques With Code'] = [f"{tech} ({tc})" for tech, tc in zip(technique_names, technique_ids)]
+
+    # low-cardinality column as categorical: less memory, faster groupby/map
+    combined_df['Tactics With Code'] = combined_df['Tactics With Code'].astype("category")
+
+    # number tactics in order of first appearance
+    tactics_order = {tac: i + 1 for i, tac in enumerate(combined_df['Tactics With Code'].drop_duplicates())}
+    combined_df['Tactics_Order'] = combined_df['Tactics With Code'].map(tactics_order).astype("int64")
+
+    combined_df['Techniques_Order'] = combined_df.groupby('Tactics With Code', sort=False, observed=True).cumcount() + 1
+
+    combined_df.rename(columns={
+        "tactic_name": "Tactics",
+        "technique_name": "Techniques",
+        "tactic_id": "Tactics Code",
+        "technique_id": "Techniques Code"
+    }, inplace=True)
 
-    combined_df = combined_df[[
+    # column order for display and export (selecting them up front would copy the frame)
+    output_columns = [
         "TT_Key",
         "ENT/ICS",
-        "tactic_name",
-        "technique_name",
+        "Tactics",
+        "Techniques",
         "Tactics_Order",
         "Techniques_Order",
-        "tactic_id",
-        "technique_id",
+        "Tactics Code",
+        "Techniques Code",
         "Tactics With Code",
         "Techniques With Code"
-    ]].rename(columns={
-        "tactic_name": "Tactics",
-        "technique_name": "Techniques",
-        "tactic_id": "Tactics Code",
-        "technique_id": "Techniques Code"
-    })
+    ]
 
     # display and allow download
     st.subheader("Combined ATT&CK Matrix")
-    st.dataframe(combined_df)
+    st.dataframe(combined_df, column_order=output_columns)
 
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        combined_df.to_excel(writer, index=False, sheet_name="Mitre Att&ck Matrix Key")
+    output = write_excel(combined_df, output_columns, "Mitre Att&ck Matrix Key")
 
     st.download_button(
         "Download Excel File",